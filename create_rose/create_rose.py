@@ -1,5 +1,11 @@
 from PIL import Image, ImageDraw
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import multiprocessing as mp
+import numpy as np
 import json
+import os
+import sys
 
 with open('./rose_static/colors.json') as f:
     colors = json.load(f)
@@ -15,42 +21,97 @@ def hex_to_rgb(hex_code):
     # (lines will still be fully opaque)
     return tuple(int(hex_code[i:i+2], 16) for i in (0, 2, 4))  + (255,)
 
-def fill_region(img, coordinates, fill_color_hex):
-    # convert hexcode to RGBA
-    fill_color = hex_to_rgb(fill_color_hex)
-    fill_img = img.copy()
-    ImageDraw.floodfill(fill_img, coordinates, fill_color)
-    return fill_img
-
-def num_to_danger(num):
-    if num == 0:
-        return 'none'
-    elif num == 1:
-        return 'low'
-    elif num == 2:
-        return 'moderate'
-    elif num == 3:
-        return 'considerable'
-    elif num == 4:
-        return 'high'
-    elif num == 5:
-        return 'extreme'
+# RGBA fill color for every color layer and danger level, parsed once
+RGBA_TABLE = {layer: {danger: hex_to_rgb(hex_code) for danger, hex_code in dangers.items()}
+              for layer, dangers in colors.items()}
+
+@lru_cache(maxsize=4)
+def load_template(image_path):
+    """Decodes the blank rose once into a read-only RGBA array."""
+    blank = np.array(Image.open(image_path).convert('RGBA'))
+    blank.setflags(write=False)
+    return blank
+
+@lru_cache(maxsize=4)
+def region_masks(image_path):
+    """Maps every seed coordinate to a boolean mask of its region on the blank rose."""
+    blank = load_template(image_path)
+    template = Image.fromarray(blank)
+    masks = {}
+    for directions in coordinates.values():
+        for coord_list in directions.values():
+            for coord in map(tuple, coord_list):
+                if coord in masks:
+                    continue
+                # flood the region once with a color guaranteed to differ from the seed,
+                # every pixel that changed belongs to the region
+                sentinel = tuple(255 - c for c in template.getpixel(coord))
+                flooded = template.copy()
+                ImageDraw.floodfill(flooded, coord, sentinel)
+                masks[coord] = (np.array(flooded) != blank).any(axis=-1)
+    return masks
+
+def fill_region(arr, mask, fill_color):
+    # paint the region in place with an RGBA color
+    arr[mask] = fill_color
+
+# danger names indexed by their numeric level
+DANGER_NAMES = ('none', 'low', 'moderate', 'considerable', 'high', 'extreme')
+
+COLOR_LAYERS = ('colors', 'light-shadow', 'dark-shadow')
+
+def build_seed_table():
+    """Maps every (level, direction) to its ordered list of (layer, coord) fills from coordinates.json."""
+    table = {}
+    for key, directions in coordinates.items():
+        level, layer = key.split('-', 1)
+        if layer not in COLOR_LAYERS:
+            continue
+        for direction, coord_list in directions.items():
+            table.setdefault((level, direction), []).extend((layer, tuple(coord)) for coord in coord_list)
+    # layers are filled colors -> light-shadow -> dark-shadow, whatever order the json lists them in
+    for fills in table.values():
+        fills.sort(key=lambda fill: COLOR_LAYERS.index(fill[0]))
+    return table
+
+SEED_TABLE = build_seed_table()
 
 def create_rose(image_path, input):
-    img = Image.open(image_path).convert('RGBA')
+    arr = load_template(image_path).copy()
+    masks = region_masks(image_path)
+    # numeric levels ('0'-'5') are converted to names once, up front,
+    # anything out of range is left as is and skipped like any unknown value
+    input = {level: {direction: DANGER_NAMES[int(danger)]
+                     if danger.isnumeric() and int(danger) < len(DANGER_NAMES) else danger
+                     for direction, danger in directions.items()}
+             for level, directions in input.items()}
     
+    # fills follow the input's level -> direction order, later fills win where seeds are
+    # shared between directions (e.g. bottom-light-shadow S and SE)
     for level, directions in input.items():
         for direction, danger in directions.items():
-            for color in ['colors', 'light-shadow', 'dark-shadow']:
-                try:
-                    for coord in coordinates["-".join([level,color])][direction]:
-                        if danger.isnumeric():
-                            danger = num_to_danger(int(danger))
-                        img = fill_region(img, coord, colors[color][danger])
-                except KeyError:
-                    pass
+            for layer, coord in SEED_TABLE.get((level, direction), ()):
+                fill_color = RGBA_TABLE[layer].get(danger)
+                if fill_color is not None:
+                    fill_region(arr, masks[coord], fill_color)
     
-    return img
+    return Image.fromarray(arr)
+
+def _save_rose(item):
+    image_path, input, output_path = item
+    create_rose(image_path, input).save(output_path)
+    return output_path
+
+def create_roses_batch(items, max_workers=None):
+    """Creates and saves a rose for every (image_path, input, output_path) item across CPU cores."""
+    # build the region masks before the pool starts so forked workers inherit them
+    for image_path in {item[0] for item in items}:
+        region_masks(image_path)
+    # on Linux fork shares the parsed JSON and masks copy-on-write; elsewhere (including macOS,
+    # where forking can crash the child) the platform's default start method is used
+    context = mp.get_context('fork') if sys.platform.startswith('linux') else None
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), mp_context=context) as executor:
+        return list(executor.map(_save_rose, items))
 
 if __name__ == '__main__':
     # Test input data
@@ -1,35 +1,139 @@
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from lxml import etree, html as lxml_html
 import pandas as pd
 import os
 import csv
 import time
 import json
+import gzip
+import hashlib
+import html
+import re
+import tempfile
+import zlib
+from io import BytesIO
+from datetime import datetime
+from functools import lru_cache
 import numpy as np
 from PIL import Image
 
+@lru_cache(maxsize=4096)
+def _parse_date(date_issued):
+    """Parse an archive 'Date Issued' string (e.g. 3/7/2024), cached since pages repeat dates."""
+    try:
+        return datetime.strptime(date_issued, '%m/%d/%Y')
+    except ValueError:
+        return pd.to_datetime(date_issued).to_pydatetime()
+
 class AvalancheForecastScraper:
     BASE_URL = 'https://utahavalanchecenter.org'
     ARCHIVES_URL = '/archives/forecasts?page='
+    MAX_WORKERS = 16  # concurrent forecast page/rose downloads
+    TIMEOUT = 10  # seconds per request
+    FORECAST_COLUMNS = ['Date Issued', 'Forecast Area', 'Link']
+    # The rose is the only <img> with this exact class, its src can come before or after the class
+    ROSE_IMG_RE = re.compile(rb'<img\b[^>]*\bclass="full-width compass-width sm-pb3"[^>]*>')
+    SRC_RE = re.compile(rb'\ssrc="([^"]*)"')
     
     def __init__(self):
         self.curr_dir = os.path.dirname(os.path.abspath(__file__))
         
+        # One session for every request so connections to the site are kept alive and reused,
+        # the pool is sized so every worker thread can hold its own connection
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.MAX_WORKERS,
+                              max_retries=Retry(total=3, backoff_factor=0.3))
+        self.session.mount('https://', adapter)
+        
+        # Forecast pages never change once published, keep them on disk between runs
+        # (the directory is created on the first write)
+        self._cache_dir = os.path.join(self.curr_dir, '.httpcache')
+        
         # Load coordinates and danger levels from JSON files
         with open(os.path.join(self.curr_dir, 'coordinates.json'), 'r') as coord_file:
             self.coordinates = json.load(coord_file)['coordinates']
 
         with open(os.path.join(self.curr_dir, 'colors.json'), 'r') as colors_file:
             self.danger_levels = {int(k): v for k, v in json.load(colors_file)['danger_levels'].items()}
+        
+        # Sample points and level colors as arrays so a rose is classified in a few NumPy calls
+        self._point_names = list(self.coordinates.keys())
+        self._coords_xy = np.array(list(self.coordinates.values()), dtype=np.int32).reshape(-1, 2)
+        self._xs, self._ys = self._coords_xy[:, 0], self._coords_xy[:, 1]
+        self._levels_arr = np.array(list(self.danger_levels.values()), dtype=np.int16).reshape(-1, 3)
+        self._level_keys = np.array(list(self.danger_levels.keys()), dtype=np.int16)
+        
+        # Only the box around the sample points is ever converted, points are indexed relative to it
+        self._bbox = (int(self._xs.min()), int(self._ys.min()), int(self._xs.max()) + 1, int(self._ys.max()) + 1)
+        self._xs_rel = self._xs - self._bbox[0]
+        self._ys_rel = self._ys - self._bbox[1]
+        
+        # Archive page queries, compiled once and reused for every page and row
+        self._empty_xp = etree.XPath("//div[contains(concat(' ', normalize-space(@class), ' '), ' view-empty ')]")
+        self._row_xp = etree.XPath('//tr')
+        self._cell_xp = etree.XPath('.//td')
+        self._href_xp = etree.XPath('(.//a/@href)[1]')
+        self._text_xp = etree.XPath('.//text()')
+    
+    def _cache_path(self, url):
+        """Cache file for a page URL."""
+        return os.path.join(self._cache_dir, hashlib.sha1(url.encode()).hexdigest() + '.gz')
+    
+    def _cached_get(self, url):
+        """Return the body of a forecast page, from the on-disk cache when it was stored before."""
+        path = self._cache_path(url)
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    return gzip.decompress(f.read())
+            except (OSError, EOFError, zlib.error) as e:
+                # Drop the unreadable entry and fetch the page again
+                print(f"Discarding corrupt cache entry for {url}: {e}")
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        
+        response = self.session.get(url, timeout=self.TIMEOUT)
+        response.raise_for_status()
+        return response.content
+    
+    def _cache_store(self, url, data):
+        """Keep a forecast page on disk for later runs. A failed write is only logged."""
+        path = self._cache_path(url)
+        if os.path.exists(path):
+            return
+        
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            # Write to a unique temporary file first so an interrupted run never leaves a partial
+            # entry, and threads storing the same page don't collide
+            fd, temp_path = tempfile.mkstemp(dir=self._cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+        except OSError as e:
+            print(f"Error caching {url}: {e}")
     
     def get_rose_link(self, url):
         """Extract the rose image URL from a forecast page."""
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-            rose_img = soup.find('img', class_="full-width compass-width sm-pb3")
-            return rose_img['src'] if rose_img else None
+            # A regex over the raw page is enough for a single attribute, no HTML parse needed
+            page = self._cached_get(url)
+            rose_img = self.ROSE_IMG_RE.search(page)
+            
+            # Only pages that already show the rose are cached, others are fetched again next run
+            if rose_img:
+                self._cache_store(url, page)
+            src = self.SRC_RE.search(rose_img.group(0)) if rose_img else None
+            return html.unescape(src.group(1).decode()) if src else None
         except Exception as e:
             print(f"Error extracting rose link from {url}: {e}")
             return None
@@ -39,103 +143,124 @@ class AvalancheForecastScraper:
         Extract danger levels from the rose image.
         Expects a PIL Image object.
         """
-        # Convert the image to HSV color space
-        hsv_image = image.convert("HSV")
-        hsv_array = np.array(hsv_image)
-
-        # Dictionary to store danger levels for each point
-        danger_levels = {}
+        # crop() pads out-of-bounds areas with black, which would read as 'extreme'
+        width, height = image.size
+        if width < self._bbox[2] or height < self._bbox[3]:
+            raise IndexError(f"Rose image {width}x{height} does not contain every sample point")
+        
+        # Extract the RGB value at every coordinate at once, shape (points, 3),
+        # and convert only those pixels to HSV
+        rgb_array = np.asarray(image.crop(self._bbox).convert("RGB"))
+        samples = self._rgb_to_hsv(rgb_array[self._ys_rel, self._xs_rel])
 
-        # Loop through each coordinate in the coordinates dictionary
-        for point, coord in self.coordinates.items():
-            # Extract the HSV value at the coordinate
-            hsv_value = hsv_array[coord[1], coord[0]]
+        # Squared Euclidean distance to each danger level, the closest match wins
+        d2 = ((samples[:, None, :].astype(np.int32) - self._levels_arr[None, :, :]) ** 2).sum(-1)
+        idx = d2.argmin(1)
 
-            # Convert HSV value to danger level
-            danger_level = self.convert_to_danger_level(hsv_value)
-            
-            # Store the danger level in the dictionary
-            danger_levels[point] = danger_level
-
-        return danger_levels
+        return dict(zip(self._point_names, self._level_keys[idx].tolist()))
     
-    def convert_to_danger_level(self, hsv_value):
-        """Convert HSV value to danger level based on the closest match."""
-        # Calculate Euclidean distance between the HSV value and each danger level
-        distances = {level: np.linalg.norm(np.array(hsv_value) - np.array(level_hsv)) 
-                     for level, level_hsv in self.danger_levels.items()}
+    def _rgb_to_hsv(self, rgb):
+        """
+        Convert an (N, 3) uint8 RGB array to HSV bytes.
+        Mirrors PIL's own RGB->HSV conversion, float32 steps included,
+        so the result matches image.convert("HSV") exactly.
+        """
+        rgb = rgb.astype(np.int32)
+        r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+        maxc = rgb.max(1)
+        cr = (maxc - rgb.min(1)).astype(np.float32)
+        grey = cr == 0
+        safe_cr = np.where(grey, np.float32(1), cr)
         
-        # Find the danger level with the minimum distance
-        closest_level = min(distances, key=distances.get)
+        s = cr / maxc.clip(1).astype(np.float32)
+        rc = ((maxc - r).astype(np.float32) / safe_cr).astype(np.float64)
+        gc = ((maxc - g).astype(np.float32) / safe_cr).astype(np.float64)
+        bc = ((maxc - b).astype(np.float32) / safe_cr).astype(np.float64)
+        h = np.where(r == maxc, bc - gc,
+                     np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc)).astype(np.float32)
+        h = np.fmod(h.astype(np.float64) / 6.0 + 1.0, 1.0).astype(np.float32)
         
-        return closest_level
+        hue = np.where(grey, 0, (h.astype(np.float64) * 255.0).astype(np.int32).clip(0, 255))
+        sat = np.where(grey, 0, (s.astype(np.float64) * 255.0).astype(np.int32).clip(0, 255))
+        return np.stack([hue, sat, maxc], 1).astype(np.uint8)
+    
+    def _download_rose(self, link):
+        """Download a rose image and return it as a PIL Image."""
+        # Check if link is a relative URL and prepend BASE_URL if needed
+        if link.startswith('/'):
+            link = self.BASE_URL + link
+        
+        # Download image data into memory buffer first, PIL needs a seekable file
+        response = self.session.get(link, timeout=self.TIMEOUT)
+        response.raise_for_status()
+        
+        # Create PIL image from memory buffer
+        return Image.open(BytesIO(response.content))
+    
+    def _process_row(self, row):
+        """Fetch the rose for a forecast row and add its danger levels to the row."""
+        link = row['Link']
+        
+        # Check if the link already includes the base URL
+        if not link.startswith('http'):
+            rose_link = self.get_rose_link(self.BASE_URL + link)
+        else:
+            rose_link = self.get_rose_link(link)
+        
+        if rose_link:
+            try:
+                pil_image = self._download_rose(rose_link)
+                
+                # Process the image to extract danger levels
+                rose_data = self.read_the_rose(pil_image)
+                row.update(rose_data)
+            except Exception as e:
+                print(f"Error processing rose image for {link}: {e}")
+        
+        return row
+    
+    def _process_rows(self, rows):
+        """Process every row concurrently, showing progress, and return the rows in input order."""
+        results = []
+        start_time = time.time()
+        
+        with ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as executor:
+            # map keeps the input order while the rows are fetched concurrently
+            for i, row in enumerate(executor.map(self._process_row, rows), start=1):
+                results.append(row)
+                
+                # Update progress
+                self._update_progress(i, len(rows), start_time)
+        
+        return results
     
     def process_rose_data(self, input_file, output_file):
         """Process the rose data from forecast images and add to CSV."""
         try:
             with open(input_file, 'r', newline='', encoding='utf-8') as infile:
                 reader = csv.DictReader(infile)
-                fieldnames = reader.fieldnames + list(self.coordinates.keys())
-                
-                # Count total rows for progress tracking
-                infile.seek(0)
-                next(reader)  # Skip header
-                total_rows = sum(1 for _ in reader)
-                
-                # Reset file pointer
-                infile.seek(0)
+                fieldnames = reader.fieldnames + self._point_names
                 rows = list(reader)
             
             # Process rows and collect results
-            results = []
-            start_time = time.time()
-            
-            for i, row in enumerate(rows, start=1):
-                link = row['Link']
-                
-                # Check if the link already includes the base URL
-                if not link.startswith('http'):
-                    rose_link = self.get_rose_link(self.BASE_URL + link)
-                else:
-                    rose_link = self.get_rose_link(link)
-                
-                if rose_link:
-                    try:
-                        # Check if rose_link is a relative URL and prepend BASE_URL if needed
-                        if rose_link.startswith('/'):
-                            rose_link = self.BASE_URL + rose_link
-                        
-                        # Download image data into memory buffer first
-                        response = requests.get(rose_link)
-                        response.raise_for_status()
-                        image_data = response.content
-                        
-                        # Create PIL image from memory buffer
-                        from io import BytesIO
-                        pil_image = Image.open(BytesIO(image_data))
-                        
-                        # Process the image to extract danger levels
-                        rose_data = self.read_the_rose(pil_image)
-                        row.update(rose_data)
-                    except Exception as e:
-                        print(f"Error processing rose image for {link}: {e}")
-                
-                results.append(row)
-                
-                # Update progress
-                self._update_progress(i, total_rows, start_time)
+            results = self._process_rows(rows)
             
             # Write results to output file
             with open(output_file, 'w', newline='', encoding='utf-8') as outfile:
-                writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(results)
+                writer = csv.writer(outfile)
+                writer.writerow(fieldnames)
+                writer.writerows([row.get(field, '') for field in fieldnames] for row in results)
                 
             print("\nCSV write complete.")
             
         except Exception as e:
             print(f"Error in process_rose_data: {e}")
     
+    def _cell_text(self, cell):
+        """Text of a table cell, with whitespace-only runs collapsed the way BeautifulSoup's get_text did."""
+        return ''.join(('\n' if '\n' in t else ' ') if not t.strip(' \n\t\f\r') else t
+                       for t in self._text_xp(cell))
+    
     def scrape_forecast_data(self, latest_date=None):
         """Scrape forecast data up to the latest_date."""
         page = 0
@@ -146,23 +271,23 @@ class AvalancheForecastScraper:
             print(f'Scraping page {page}', end='\r')
             
             try:
-                response = requests.get(url)
+                response = self.session.get(url, timeout=self.TIMEOUT)
                 response.raise_for_status()
-                soup = BeautifulSoup(response.text, 'html.parser')
+                tree = lxml_html.fromstring(response.content)
                 
                 # Check if the page has no results
-                if soup.find('div', class_='view-empty'):
+                if self._empty_xp(tree):
                     print("\nNo more results found. Stopping.")
                     break
                 
                 # Extract data from table rows
-                table_rows = soup.find_all('tr')
+                table_rows = self._row_xp(tree)
                 
                 for row in table_rows[1:]:  # Skip header row
-                    columns = row.find_all('td')
-                    date_issued = columns[0].get_text().strip()
-                    forecast_area = columns[1].get_text()[11:-15].strip()
-                    link = columns[1].find('a')['href']
+                    columns = self._cell_xp(row)
+                    date_issued = self._cell_text(columns[0]).strip()
+                    forecast_area = self._cell_text(columns[1])[11:-15].strip()
+                    link = str(self._href_xp(columns[1])[0])
                     
                     # Ensure the link has the full URL
                     if not link.startswith('http'):
@@ -175,7 +300,7 @@ class AvalancheForecastScraper:
                     })
                     
                     # Stop if we've reached the latest date
-                    if latest_date and pd.to_datetime(date_issued) <= latest_date:
+                    if latest_date and _parse_date(date_issued) <= latest_date:
                         return pd.DataFrame(data)
                 
                 page += 1
@@ -194,21 +319,50 @@ class AvalancheForecastScraper:
         seconds = elapsed_time % 60
         print(f"Progress: {percent_complete:.2f}% complete. {minutes} min {seconds:.2f} sec elapsed.", end='\r', flush=True)
     
+    def _latest_date(self, path, tail_bytes=4096):
+        """
+        Find the most recent 'Date Issued' in the dataset CSV.
+        New rows are appended oldest first, so the last row holds the latest date and only
+        the end of the file is read. Files whose tail isn't in ascending order (written before
+        that) fall back to reading the whole date column. Returns None for an empty file.
+        """
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return None
+            f.seek(max(0, size - tail_bytes))
+            # The first line is either cut off by the seek (possibly mid-character) or the header
+            lines = f.read().decode('utf-8', errors='ignore').splitlines()[1:]
+        
+        try:
+            dates = [_parse_date(line.split(',', 1)[0]) for line in lines if line]
+        except ValueError:
+            # Anything unexpected in the tail is settled by the full read below
+            dates = None
+        if dates and all(a <= b for a, b in zip(dates, dates[1:])):
+            return dates[-1]
+        
+        existing_dates = pd.read_csv(path, usecols=['Date Issued'])['Date Issued']
+        return pd.to_datetime(existing_dates).max()
+    
     def run(self):
         """Main execution function."""
         try:
             # Define main output file path
             output_csv = os.path.join(self.curr_dir, '..', 'avalanche-forecast-rose.csv')
             
-            # Load existing data to find latest date
+            # Read the latest date from the end of the existing data
             try:
-                existing_data = pd.read_csv(output_csv)
-                latest_date = pd.to_datetime(existing_data['Date Issued']).max()
-                print(f"Getting forecasts newer than {latest_date}")
-            except (FileNotFoundError, KeyError):
+                latest_date = self._latest_date(output_csv)
+            except FileNotFoundError:
+                latest_date = None
+            
+            if latest_date is None or pd.isna(latest_date):
                 latest_date = None
-                existing_data = pd.DataFrame()
                 print("No existing data found, scraping all available forecasts")
+            else:
+                print(f"Getting forecasts newer than {latest_date}")
             
             # Scrape new forecast data
             new_data_df = self.scrape_forecast_data(latest_date)
@@ -219,66 +373,32 @@ class AvalancheForecastScraper:
                 
             print(f"Found {len(new_data_df)} new forecasts to process")
             
-            # Process rows and collect results
-            results = []
-            start_time = time.time()
+            # Process rows and collect results, the archive lists newest first so
+            # they are reversed to keep the file in ascending date order
+            results = self._process_rows(new_data_df.to_dict('records'))[::-1]
             
-            for i, row in enumerate(new_data_df.to_dict('records'), start=1):
-                link = row['Link']
-                
-                # Check if the link already includes the base URL
-                if not link.startswith('http'):
-                    rose_link = self.get_rose_link(self.BASE_URL + link)
-                else:
-                    rose_link = self.get_rose_link(link)
-                
-                if rose_link:
-                    try:
-                        # Check if rose_link is a relative URL and prepend BASE_URL if needed
-                        if rose_link.startswith('/'):
-                            rose_link = self.BASE_URL + rose_link
-                        
-                        # Download image data into memory buffer first
-                        response = requests.get(rose_link)
-                        response.raise_for_status()
-                        image_data = response.content
-                        
-                        # Create PIL image from memory buffer
-                        from io import BytesIO
-                        pil_image = Image.open(BytesIO(image_data))
-                        
-                        # Process the image to extract danger levels
-                        rose_data = self.read_the_rose(pil_image)
-                        row.update(rose_data)
-                    except Exception as e:
-                        print(f"Error processing rose image for {link}: {e}")
-                
-                results.append(row)
-                
-                # Update progress
-                self._update_progress(i, len(new_data_df), start_time)
-            
-            # Create a DataFrame with all processed results
-            results_df = pd.DataFrame(results)
+            # Header of the existing data, None when the file is missing or empty
+            fieldnames = None
+            if os.path.exists(output_csv):
+                with open(output_csv, 'r', newline='', encoding='utf-8') as f:
+                    fieldnames = next(csv.reader(f), None)
             
-            # Write results to temporary file first
-            temp_output = os.path.join(self.curr_dir, '..', 'temp_avalanche-forecast-rose.csv')
-            
-            if not os.path.exists(output_csv):
-                # Create new file if doesn't exist
-                results_df.to_csv(temp_output, index=False)
+            if fieldnames is None:
+                # Create new file with every column, even when no rose could be read in this run,
+                # via a temporary file so a failed write leaves nothing behind
+                temp_output = os.path.join(self.curr_dir, '..', 'temp_avalanche-forecast-rose.csv')
+                results_df = pd.DataFrame(results, columns=self.FORECAST_COLUMNS + self._point_names)
+                results_df.to_csv(temp_output, index=False, lineterminator=os.linesep)
+                os.replace(temp_output, output_csv)
             else:
-                # Combine with existing data and save to temp file
-                combined_df = pd.concat([existing_data, results_df], ignore_index=True)
-                combined_df.to_csv(temp_output, index=False)
+                # Append only the new rows under the existing header, historical rows are never rewritten,
+                # with the platform line endings (os.linesep) that to_csv writes by default
+                with open(output_csv, 'a', newline='', encoding='utf-8') as f:
+                    writer = csv.writer(f, lineterminator=os.linesep)
+                    writer.writerows([row.get(field, '') for field in fieldnames] for row in results)
+                    f.flush()
+                    os.fsync(f.fileno())
             
-            # Only after successful write to temp file, rename to actual output file
-            if os.path.exists(temp_output):
-                if os.path.exists(output_csv):
-                    os.replace(temp_output, output_csv)  # Atomic operation
-                else:
-                    os.rename(temp_output, output_csv)
-                
             print(f"\nAdded {len(results)} new forecasts to {output_csv}")
             
         except Exception as e: